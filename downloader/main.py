@@ -1,18 +1,30 @@
 import asyncio
+import base64
 import json
 import os
 import re
 import time
 import sys
 import warnings
-from typing import Tuple, List
-from urllib.parse import urlparse
+from contextlib import aclosing, nullcontext
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
 
 import click
 import httpx
-import psutil
 from click.exceptions import Exit, Abort
-from httpx import AsyncClient, Response, __version__, Timeout, TimeoutException, ReadError, ConnectError
+from httpx import (
+    AsyncClient,
+    Response,
+    __version__,
+    Timeout,
+    TimeoutException,
+    ReadError,
+    ConnectError,
+    Limits,
+    RemoteProtocolError,
+)
 from rich.markup import escape
 from rich.progress import (
     Progress,
@@ -22,10 +34,15 @@ from rich.progress import (
     TaskProgressColumn,
     TimeRemainingColumn,
     TextColumn,
+    TaskID,
 )
 from rich.console import Console
 from pathlib import Path
-from io import BytesIO
+
+try:
+    import uvloop
+except ImportError:  # uvloop doesn't support Windows
+    uvloop = None
 
 
 USER_AGENTS = {
@@ -38,84 +55,192 @@ USER_AGENTS = {
     "Version/15.3 Safari/605.1.15",
     "default": "python-httpx/" + __version__,
 }
-WARNING_DISPLAYED = False
-
-
-async def check_ram(console: Console, event: asyncio.Event, warning_at: int = 1):
-    global WARNING_DISPLAYED
-    worry_level = 1024**3 * warning_at
-    while not event.is_set():
-        result = await asyncio.to_thread(psutil.virtual_memory)
-        if result.available < worry_level:
-            if WARNING_DISPLAYED is False:
-                console.log(
-                    "[red]Memory warning: Less than %d gigabyte%s of memory is available! (%.2fGB Free)"
-                    % (warning_at, "s" if warning_at != 1 else "", result.available / 1024**3)
-                )
-                WARNING_DISPLAYED = True
-        else:
-            if WARNING_DISPLAYED:
-                console.log("[green]Memory warning resolved.")
-                WARNING_DISPLAYED = False
-        await asyncio.sleep(5)
-
-
-async def requires_authentication(client: AsyncClient, url: str, *, method: str = "GET", **kwargs) -> bool:
-    if kwargs.pop("try_head_first", False) is True:
-        response = await client.head(url, **kwargs)
-        if response.status_code == 401 and response.headers.get("WWW-Authenticate", "").startswith("Basic"):
-            return True
-
-    async with client.stream(method, url, **kwargs) as response:
-        # the response is streamed here to avoid downloading the entire body to RAM before we even start
-        await response.aclose()
-        if response.status_code == 401 and response.headers.get("WWW-Authenticate", "").startswith("Basic"):
-            # We only support basic auth rn
-            return True
-        return False
+SANITISE_PATTERN = re.compile(r"[^\w\-.]")
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-\d+/(?:\d+|\*)")
+PROGRESS_UPDATE_INTERVAL = 0.1  # seconds between progress bar updates while a download is running
+
+
+@dataclass(slots=True)
+class Job:
+    """A URL to download, along with everything about it that can be worked out before sending a request."""
+
+    url: str
+    hostname: str
+    dest: Path
+    named: bool = False  # whether dest was chosen by the user, and so shouldn't be renamed after redirects
+
+    @classmethod
+    def from_url(cls, url: str, directory: Path, file_name: str = None) -> "Job":
+        parsed = urlparse(url)
+        if file_name is not None:
+            return cls(url, parsed.hostname or "", Path(file_name), named=True)
+        return cls(url, parsed.hostname or "", directory / safe_file_name(unquote(parsed.path)))
+
+
+def safe_file_name(path: str) -> str:
+    """Turns the last segment of a (decoded) URL path into something that's safe to use as a file name."""
+    return SANITISE_PATTERN.sub("-", path.rsplit("/", 1)[-1]) or "index"
+
+
+def iter_body(response: Response, chunk_size: int):
+    """Iterates over a streamed response body, skipping httpx's decoders when the body isn't encoded."""
+    if response.headers.get("Content-Encoding", "identity").lower() == "identity":
+        return response.aiter_raw(chunk_size)
+    return response.aiter_bytes(chunk_size)
+
+
+def _resume_validator(response: Response) -> Optional[str]:
+    """Returns the If-Range validator to resume a response's download with, or None if it can't safely be resumed."""
+    # A dropped connection can only be picked up where it left off if the server supports ranges, the bytes on disk
+    # are the same bytes it sent (i.e. nothing was decompressed on the way), and there's a validator for If-Range so
+    # we don't splice two different versions of the file together.
+    if response.headers.get("Accept-Ranges") != "bytes":
+        return None
+    if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+        return None
+    validator = response.headers.get("ETag")
+    if validator is None or validator.startswith("W/"):
+        # If-Range only accepts strong entity tags.
+        validator = response.headers.get("Last-Modified")
+    return validator
+
+
+def _origin(url: httpx.URL) -> Tuple[str, str, Optional[int]]:
+    return url.scheme, url.host, url.port
+
+
+def basic_auth_header(username: str, password: str) -> str:
+    """Builds the value of an Authorization header for HTTP basic auth."""
+    return "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode("ascii")
+
+
+def _open_part(part_file: Path) -> int:
+    """Opens (truncating) a partial download for writing."""
+    fd = os.open(part_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return fd
+
+
+def _close_part(fd: int):
+    """Closes a finished partial download, telling the kernel we won't be reading it back."""
+    try:
+        if hasattr(os, "posix_fadvise"):
+            # Not available on Windows or macOS. This is only a hint: pages that haven't been written back yet are
+            # left alone, so it mostly helps with files that were written slower than the kernel flushes them.
+            # Flushing here ourselves would hold up the next download on the disk.
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _write_all(fd: int, data: bytes):
+    """Writes all of data to fd, carrying on after any short writes."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def _rewind_part(fd: int):
+    """Throws away everything written to a partial download so far."""
+    os.ftruncate(fd, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+
+
+def _discard(fd: Optional[int], part_file: Path):
+    """Closes (if it's still open) and deletes a partially written download."""
+    if fd is not None:
+        os.close(fd)
+    part_file.unlink(missing_ok=True)
+
+
+async def _run_to_completion(func, *args):
+    """
+    Runs func in a worker thread. If we're cancelled while it's running, it's allowed to finish before the
+    cancellation carries on, so that cleanup never races it (e.g. closing a file descriptor that's being written to).
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
 
 
 async def downloader(
     client: AsyncClient,
     progress: Progress,
-    url: str,
-    file: Path = None,
-    directory: Path = Path.cwd(),
+    job: Job,
+    task: TaskID,
     *,
-    authorisation: Tuple[str, str] = None,
-    buffer: bool = True,
+    authorisation: str = None,
     chunk_size: float = 1024**2,
+    resume_attempts: int = 3,
+    known_credentials: Dict[Tuple[str, str, Optional[int]], str] = None,
 ):
-    _url = urlparse(url)
-    display_domain = _url.hostname
-    task = progress.add_task("Check authentication status of  %s" % display_domain, total=0, completed=0, start=False)
-    req = client.stream("GET", url, auth=authorisation)
+    if known_credentials is None:
+        known_credentials = {}
+    url = job.url
+    file = job.dest
+    display_domain = job.hostname
+    request_headers = {}
+    # Credentials are remembered per origin (of the response that challenged us), so they're never sent over a
+    # different scheme or port than asked for.
+    origin = _origin(httpx.URL(url))
+    if origin in known_credentials:
+        # This origin has already challenged another download, so there's no need to wait to be asked again.
+        request_headers["Authorization"] = known_credentials[origin]
     try:
-        requires = await requires_authentication(client, url, try_head_first=True)
+        # Otherwise, assume the URL is public and only upgrade to basic auth once the server actually challenges
+        # us, rather than spending an extra round trip up front to find out.
+        response = await client.send(client.build_request("GET", url, headers=request_headers), stream=True)
+        if (
+            response.status_code == 401
+            and "Authorization" not in request_headers
+            and response.headers.get("WWW-Authenticate", "").startswith("Basic")
+        ):
+            # We only support basic auth rn
+            await response.aclose()
+            # If we were redirected, it's the final URL that wants credentials, so that's where they go (and the
+            # redirecting origin never sees them).
+            url = str(response.url)
+            origin = _origin(response.url)
+            # Another download may have been challenged (and prompted) by the same origin while we were waiting.
+            authorisation = authorisation or known_credentials.get(origin)
+            if not authorisation and not sys.stdin.isatty():
+                # There's nobody to ask for credentials, so there's no point retrying.
+                progress.start_task(task)
+                progress.update(
+                    task,
+                    total=1,
+                    completed=1,
+                    description="Get %s - [red]authentication required[/]" % display_domain,
+                )
+                return
+            if not authorisation:
+                progress.stop()
+                progress.console.clear()
+                progress.console.log(
+                    "%s requires authentication. Please input a username and password." % display_domain
+                )
+                username = progress.console.input("Username: ")
+                password = progress.console.input("Password: ", password=True)
+                progress.start()
+                authorisation = basic_auth_header(username, password)
+            progress.console.log("%s requires authentication. Sending basic auth." % display_domain)
+            known_credentials[origin] = request_headers["Authorization"] = authorisation
+            request = client.build_request("GET", url, headers=request_headers)
+            response = await client.send(request, stream=True)
     except httpx.HTTPError as e:
-        progress.console.log("Failed to check the authentication status of %s:", e)
+        progress.console.log(f"[red]Failed to connect to {display_domain}: {e!r}")
         progress.update(task, total=1, completed=1, description="Get %s - failed!" % display_domain)
         return
 
-    if requires:
-        if not authorisation:
-            progress.stop()
-            progress.console.clear()
-            progress.console.log("%s requires authentication. Please input a username and password." % display_domain)
-            username = progress.console.input("Username: ")
-            password = progress.console.input("Password: ", password=True)
-            progress.start()
-            authorisation = (username, password)
-        progress.console.log("%s requires authentication. Sending basic auth." % display_domain)
-        del req
-        req = client.stream("GET", url, auth=authorisation)
-    else:
-        progress.console.log("%s does not require authentication." % display_domain)
     try:
-        async with req as response:
+        async with aclosing(response):
             progress.start_task(task)
             response: Response
-            if response.status_code not in range(200, 300):
+            if not 200 <= response.status_code < 300:
                 progress.update(
                     task,
                     total=1,
@@ -141,13 +266,13 @@ async def downloader(
             display_domain = ">".join(reversed(display_domain.split("/")))
             # ^ This just reverses the order of the domains so that they're in the correct order
 
-            if file is None:
-                url = response.url.path
-                fp = url.split("/")[-1]
-                file = directory / fp
-                file = file.with_name(re.sub(r"[^\w\-.]", "-", file.name))
+            if not job.named:
+                if response.history:
+                    # Redirects usually land somewhere with a more useful name than the original URL.
+                    file = file.with_name(safe_file_name(response.url.path))
                 progress.console.log(
-                    f"Saving {escape(repr(url))} to [blue][link={file.absolute().as_uri()}]{file.name}[/]."
+                    f"Saving {escape(repr(response.url.path))} to "
+                    f"[blue][link={file.absolute().as_uri()}]{file.name}[/]."
                 )
 
             if not file.suffix and response.headers.get("Content-Type"):
@@ -170,95 +295,157 @@ async def downloader(
             except (TypeError, ValueError):
                 progress.update(task, total=1, completed=1, description="Get %s - failed!" % display_domain)
             else:
-                progress.update(
-                    task,
-                    total=length,
-                    completed=0,
-                    description="Get %s (%r)"
-                    % (
-                        display_domain,
-                        file.name,
-                    ),
-                    pulse=True,
-                )
-
-                if buffer:
-                    write_file = BytesIO()
-                else:
-                    write_file = file.open("wb+")
+                description = "Get %s (%r)" % (display_domain, file.name)
+                progress.update(task, total=length, completed=0, description=description, pulse=True)
 
+                part_file = file.with_name(file.name + ".part")
+                fd = None
+                validator = _resume_validator(response)
+                stream = response
+                written = 0  # bytes on disk
+                offset = 0  # bytes on disk before the current stream started
+                attempts = 0
+                task_total = length or 0
+                reported = 0
+                last_update = time.monotonic()
                 try:
-                    async for chunk in response.aiter_bytes(chunk_size):
-                        write_file.write(chunk)
-                        # noinspection PyProtectedMember
-                        if progress._tasks[task].total <= response.num_bytes_downloaded:
-                            _total = response.num_bytes_downloaded
+                    opening = asyncio.ensure_future(asyncio.to_thread(_open_part, part_file))
+                    try:
+                        fd = await asyncio.shield(opening)
+                    except asyncio.CancelledError:
+                        # The file still gets opened, so make sure that it's the cleanup below that closes it.
+                        await asyncio.wait([opening])
+                        if not opening.exception():
+                            fd = opening.result()
+                        raise
+                    while True:
+                        try:
+                            async for chunk in iter_body(stream, chunk_size):
+                                await _run_to_completion(_write_all, fd, chunk)
+                                written += len(chunk)
+                                now = time.monotonic()
+                                if now - last_update < PROGRESS_UPDATE_INTERVAL:
+                                    continue
+                                last_update = now
+                                downloaded = offset + stream.num_bytes_downloaded
+                                if task_total < downloaded:
+                                    task_total = downloaded
+                                    progress.update(task, total=task_total)
+                                progress.advance(task, downloaded - reported)
+                                reported = downloaded
+                            break
+                        except (ReadError, TimeoutException, RemoteProtocolError) as e:
+                            error = e
+
+                        # Reconnecting is just as likely to fail as the transfer was, so that gets retried too.
+                        while True:
+                            if validator is None or attempts >= resume_attempts:
+                                raise error
+                            attempts += 1
+                            await stream.aclose()
+                            progress.console.log(
+                                f"[yellow]Lost connection downloading {file.name} ({error!r}), "
+                                f"resuming from byte {written}."
+                            )
+                            request = client.build_request(
+                                "GET",
+                                url,
+                                headers={**request_headers, "Range": "bytes=%d-" % written, "If-Range": validator},
+                            )
+                            try:
+                                stream = await client.send(request, stream=True)
+                                break
+                            except (ConnectError, ReadError, TimeoutException, RemoteProtocolError) as e:
+                                error = e
+
+                        if stream.status_code == 206:
+                            content_range = CONTENT_RANGE_PATTERN.fullmatch(stream.headers.get("Content-Range", ""))
+                            if content_range is None or int(content_range.group(1)) != written:
+                                # Not the part we asked for, so there's no safe way to carry on.
+                                await stream.aclose()
+                                raise error
+                            offset = written
+                        elif stream.status_code == 416 and written == length:
+                            # We'd already got everything, the connection just didn't close cleanly.
+                            await stream.aclose()
+                            offset = written
+                            break
+                        elif 200 <= stream.status_code < 300:
+                            # The server ignored the range, or the file changed since we started, so start again
+                            # from the top, with whatever this response says about the (possibly new) file.
+                            await _run_to_completion(_rewind_part, fd)
+                            written = offset = reported = 0
+                            validator = _resume_validator(stream)
+                            length = stream.headers.get("Content-Length")
+                            length = int(length) if length is not None and length.isdigit() else None
+                            task_total = length or 0
+                            progress.update(task, total=length, completed=0)
                         else:
-                            # noinspection PyProtectedMember
-                            _total = progress._tasks[task].total
-                        progress.update(
-                            task,
-                            total=_total,
-                            completed=response.num_bytes_downloaded,
-                            description="Get %s (%r)"
-                            % (
-                                display_domain,
-                                file.name,
-                            ),
-                            pulse=True,
-                        )
-                except (KeyboardInterrupt, RuntimeError):
+                            await stream.aclose()
+                            raise error
+                    await stream.aclose()
+                    downloaded = offset + stream.num_bytes_downloaded
+                    progress.update(task, total=max(task_total, downloaded), completed=downloaded)
+                    # fd is cleared first, so the cleanup below can't close it a second time if we're cancelled.
+                    fd, finished = None, fd
+                    await _run_to_completion(_close_part, finished)
+                    await _run_to_completion(os.replace, part_file, file)
+                except (KeyboardInterrupt, RuntimeError, asyncio.CancelledError) as e:
                     progress.console.log(f"Cancelling download {file.name!r}")
-                    write_file.close()
+                    _discard(fd, part_file)
                     try:
-                        await response.aclose()
+                        await stream.aclose()
                     except (Exception, RuntimeError):
-                        response.close()
+                        stream.close()
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
                     return
-                except (ReadError, TimeoutException, ConnectError) as e:
+                except (ReadError, TimeoutException, ConnectError, RemoteProtocolError) as e:
                     progress.remove_task(task)
                     progress.console.log(f"[red]Fatal error downloading {file.name}: {repr(e)}")
-                    write_file.close()
+                    await asyncio.to_thread(_discard, fd, part_file)
                     try:
-                        await response.aclose()
+                        await stream.aclose()
                     except (Exception, RuntimeError):
-                        response.close()
+                        stream.close()
                     return
-                write_file.flush()
-                if buffer:
-                    with file.open("wb+") as foo:
-                        foo.write(write_file.read())
-                write_file.close()
+                except Exception:
+                    # Don't leave a half-written file behind, download_job will report the error.
+                    await asyncio.to_thread(_discard, fd, part_file)
+                    raise
     except (ReadError, TimeoutException, ConnectError) as e:
-        if file is None:
-            file = Path(os.urandom(6).hex())
         progress.remove_task(task)
         progress.console.log(f"[red]Fatal error downloading {file.name}: {repr(e)}")
-        try:
-            write_file.close()
-        except UnboundLocalError:
-            pass
-        try:
-            await response.aclose()
-        except RuntimeError:
-            response.close()
-        except UnboundLocalError:
-            pass
         return
 
 
+async def download_job(
+    client: AsyncClient, progress: Progress, job: Job, *, semaphore: asyncio.Semaphore = None, **kwargs
+):
+    """Runs downloader for a single job, making sure that one broken download can't take the rest down with it."""
+    async with semaphore or nullcontext():
+        task = progress.add_task("Get %s" % job.hostname, total=0, completed=0, start=False)
+        try:
+            await downloader(client, progress, job, task, **kwargs)
+        except Exception as e:
+            progress.console.log(f"[red]Fatal error downloading {escape(job.url)}: {escape(repr(e))}")
+            if task in progress.task_ids:
+                progress.update(task, total=1, completed=1, description="Get %s - failed!" % job.hostname)
+
+
 @click.command()
 @click.argument("urls", nargs=-1)
 @click.option("--username", default=None)
 @click.option("--password", default=None, help="The password to access websites (only sent if requested)")
-@click.option("--buffer", default=False, is_flag=True, help="Whether to write data to memory before disk (faster)")
+@click.option("--buffer", default=False, is_flag=True, hidden=True, help="Deprecated, has no effect.")
 @click.option("--output-directory", "-O", type=Path, default=Path.cwd())
 @click.option("--user-agent", default="default", help="Which user agent to select. Can be custom or a browser name.")
 @click.option(
     "--ram-warning-at",
     type=int,
     default=1,
-    help="At what point to worry about ram usage (display a warning when there is less than this much ram free)",
+    hidden=True,
+    help="Deprecated, has no effect.",
 )
 @click.option(
     "--from-list",
@@ -278,6 +465,19 @@ async def downloader(
 @click.option(
     "--chunk-size", "-S", type=int, default=1024 * 1024, help="The size of download chunks. Defaults to 1mib."
 )
+@click.option(
+    "--resume-attempts",
+    type=click.IntRange(min=0),
+    default=3,
+    help="How many times to resume a download after its connection drops, if the server allows it. Defaults to 3.",
+)
+@click.option(
+    "--max-concurrency",
+    "-J",
+    type=click.IntRange(min=1),
+    default=16,
+    help="The maximum number of downloads (and connections) to run at once. Defaults to 16.",
+)
 def cli_main(
     urls: List[str],
     username: str = None,
@@ -292,6 +492,8 @@ def cli_main(
     read_timeout: float = 60.0,
     connect_timeout: float = 60.0,
     chunk_size: int = 1024 * 1024,
+    max_concurrency: int = 16,
+    resume_attempts: int = 3,
 ):
     if Path("./cookies.json").exists():
         cookies = json.loads(Path("./cookies.json").read_text())
@@ -302,7 +504,7 @@ def cli_main(
     )
     urls = list(urls)
     follow_redirects = not ignore_redirects
-    console = Console()
+    console = Console(highlight=False)
     if from_list is not None:
         with from_list.open("r") as _file:
             urls += list(filter(lambda ln: bool(ln), _file.readlines()))
@@ -326,25 +528,17 @@ def cli_main(
     else:
         console.log("Using the user agent %r" % user_agent.lower())
     if buffer:
-        console.log(
-            "Notice: Data will be written to RAM before writing to disk. "
-            "[u]If the download is interrupted, data will be lost!"
-        )
+        console.log("Notice: --buffer no longer has any effect. Downloads are always streamed to disk.")
     if type(username) != type(password):
         raise click.BadOptionUsage("username", "Username must be supplied with password or both omitted.")
     elif username is None and password is None:
         auth = None
     else:
-        auth = (username, password)
+        auth = basic_auth_header(username, password)
 
     if not urls:
         raise click.BadArgumentUsage("No urls were provided")
 
-    for _url in urls:
-        if urls.count(_url) != 1:
-            console.log("Duplicate URL %r - ignoring" % _url)
-            urls.pop(urls.index(_url))
-
     if file_names:
         file_names = list(file_names.split(","))
         for _n, fn in enumerate(file_names):
@@ -354,10 +548,31 @@ def cli_main(
     else:
         file_names = [None] * len(urls)
 
+    seen = {}
+    for _url, fn in zip(urls, file_names):
+        seen.setdefault(_url.strip(), fn)
+    if len(seen) != len(urls):
+        console.log("Ignoring %d duplicate URL(s)" % (len(urls) - len(seen)))
+    urls, file_names = list(seen.keys()), list(seen.values())
+
+    jobs = []
+    for _url, fn in zip(urls, file_names):
+        try:
+            jobs.append(Job.from_url(_url, output_directory, fn))
+        except ValueError as e:
+            console.log(f"[red]Skipping invalid URL {escape(repr(_url))}: {escape(str(e))}")
+    if not jobs:
+        raise click.BadArgumentUsage("No valid urls were provided")
+    # Keep downloads from the same host next to each other so they can reuse pooled connections.
+    # This means downloads are not guaranteed to start in the order they were given.
+    jobs.sort(key=lambda job: job.hostname)
+
     async def run():
-        threads = []
-        timer = None
-        timer_event = asyncio.Event()
+        if hasattr(asyncio, "eager_task_factory"):
+            # Python 3.12+: let each download run up to its first await as soon as it's created.
+            asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        known_credentials = {}
         async with AsyncClient(
             http2=True,
             headers={"User-Agent": ua},
@@ -365,6 +580,7 @@ def cli_main(
             timeout=timeout,
             cookies=cookies,
             trust_env=True,
+            limits=Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
         ) as client:
             try:
                 columns, _ = os.get_terminal_size()
@@ -400,30 +616,24 @@ def cli_main(
                 expand=True,
                 console=console,
             ) as progress:
-                if buffer:
-                    timer = asyncio.create_task(check_ram(progress.console, timer_event, ram_warning_at))
-                for n, url in enumerate(urls):
-                    url = url.strip()
-                    if file_names[n] is not None:
-                        path = Path(file_names[n])
-                    else:
-                        path = None
-                    task = asyncio.create_task(
-                        downloader(
-                            client,
-                            progress,
-                            url,
-                            path,
-                            authorisation=auth,
-                            directory=output_directory,
-                            buffer=buffer,
-                            chunk_size=chunk_size,
-                        )
-                    )
-                    threads.append(task)
                 try:
-                    await asyncio.wait(threads, timeout=None, return_when=asyncio.ALL_COMPLETED)
-                except (KeyboardInterrupt, asyncio.CancelledError, RuntimeError, Exception):
+                    async with asyncio.TaskGroup() as task_group:
+                        for job in jobs:
+                            task_group.create_task(
+                                download_job(
+                                    client,
+                                    progress,
+                                    job,
+                                    authorisation=auth,
+                                    chunk_size=chunk_size,
+                                    semaphore=semaphore,
+                                    resume_attempts=resume_attempts,
+                                    known_credentials=known_credentials,
+                                )
+                            )
+                except* (KeyboardInterrupt, asyncio.CancelledError):
+                    # The task group has already cancelled (and awaited) every outstanding download by now.
+                    # Anything else that goes wrong is dealt with per-download by download_job.
                     console.log("Cancelling...")
                     for task in progress.tasks:
                         if task.completed != task.total:
@@ -435,24 +645,10 @@ def cli_main(
                             )
                     progress.refresh()
                     progress.stop()
-                    for thread in threads:
-                        try:
-                            if thread.exception():
-                                pass
-                            else:
-                                thread.cancel()
-                        except asyncio.InvalidStateError:
-                            pass
-
-                    for thread in threads:
-                        await thread
                     raise Abort()
-                finally:
-                    timer_event.set()
-                    if timer:
-                        timer.cancel()
 
-    asyncio.run(run())
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop if uvloop else None) as runner:
+        runner.run(run())
 
 
 if __name__ == "__main__":
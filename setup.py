@@ -18,6 +18,7 @@ setup(
     author_email="",
     description="I got bored and decided I wanted a cool looking downloader.",
     install_requires=requirements,
+    python_requires=">=3.11",
     entry_points={
         "console_scripts": [
             "cdl = downloader.main:cli_main",